@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# benchmark of read_file on a huge generated appletsrc like file, prints time
+# and speedup for each number of jobs
+#
+# usage: bench_parse.py [size in MiB] [max jobs, defaults to number of cores]
+
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import kcfg
+
+def generate(size: int) -> str:
+    '''Generates config text of about size characters'''
+    lines = []
+    length = 0
+    i = 0
+    while length < size:
+        section = f"""[Containments][{i}][Applets][{i * 7}][Configuration][General]
+immutability=1
+plugin=org.kde.plasma.applet{i}
+ColorAmount=0.025000000000000001
+Color=112,111,110
+launchers=applications:org.kde.dolphin.desktop,applications:firefox.desktop
+
+"""
+        lines.append(section)
+        length += len(section)
+        i += 1
+
+    return ''.join(lines)
+
+def bench(text: str, jobs: int, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        kcfg.read_file(io.StringIO(text), jobs)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    cores = os.cpu_count() or 1
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else cores
+    text = generate(size * 1024 * 1024)
+
+    print(f'Parsing {len(text) / 1024 / 1024:.1f} MiB on {cores} cores')
+
+    serial = bench(text, 1)
+    print(f'  1 jobs: {serial:.3f}s')
+
+    jobs = 2
+    while jobs <= limit:
+        elapsed = bench(text, jobs)
+        print(f'  {jobs} jobs: {elapsed:.3f}s ({serial / elapsed:.2f}x)')
+        jobs *= 2
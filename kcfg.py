@@ -25,16 +25,26 @@
 """Tool to read and write KDE INI config files, replaces kwriteconfig5 / kreadconfig5
 """
 
+# annotations are not evaluated so typing does not have to be imported at runtime
+from __future__ import annotations
+
 __version__ = '0.1.1'
 __version_api__ = __version__.replace('.', '')
 
 import sys
 import os
-import configparser
-import argparse
+import time
+import mmap
+import struct
+import zlib
+
+# NOTE all other modules (even re and configparser) are imported in the
+# functions that use them, shell completion runs on every TAB press so
+# importing the module has to stay fast
 
-from io import StringIO
-from typing import Tuple, List, Optional
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Tuple, List, Optional
 
 PREDEFINED_FILES = {}
 
@@ -97,8 +107,6 @@ _DOT_CONFIG_FILES = [
 for file in _DOT_CONFIG_FILES:
     PREDEFINED_FILES[file.lower()] = os.path.join(os.getenv('HOME'), '.config', file)
 
-_QUIET = False
-
 def _parse_path(path: str) -> Tuple[List[str], str]:
     """Parses path for the setting, returns the name of section and optionally file
 
@@ -131,10 +139,14 @@ def _parse_path(path: str) -> Tuple[List[str], str]:
     # im stripping the path just in case, this may not be a good idea but eh
     return [x.strip() for x in segments], file
 
-def _print_configs(): # pragma: no cover
+def _home_files(files, home) -> dict:
+    '''Returns files with their paths moved to ~/.config of home'''
+    return { x: os.path.join(home, '.config', os.path.basename(y)) for x, y in files.items() }
+
+def _print_configs(files: dict):
     '''Prints all configs files that are known'''
     print('Config files that are known')
-    for k, v in PREDEFINED_FILES.items():
+    for k, v in files.items():
         print('  ' + v)
     print()
     print('If you feel like any are missing or should be removed make an issue at:')
@@ -147,6 +159,12 @@ def _print_version_api(): # pragma: no cover
 
 def _create_parser():
     '''Function that builds the parser'''
+    import argparse
+
+    class Parser(argparse.ArgumentParser):
+        '''Parser that raises KcfgError instead of exiting on bad arguments'''
+        def error(self, message):
+            raise KcfgError(f"{message}\n{self.format_usage().strip()}", 2)
 
     def make_final_action(fn): # pragma: no cover
         '''Creates argparse action that runs fn and then quits'''
@@ -160,7 +178,7 @@ def _create_parser():
 
         return custom_action
 
-    parser = argparse.ArgumentParser(
+    parser = Parser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
         prog='kcfg',
         description=r"""
@@ -193,6 +211,18 @@ Examples:
         To delete add --delete
 
     $ kcfg --file ~/.config/kcminputrc '/Group 1/Group 2/Key' --delete
+
+        To rename, move or rewrite keys in all config files at once
+
+    $ kcfg --migrate rules.ini --dry-run
+
+        To extract typed values from many homes into a table
+
+    $ kcfg --extract 'color:kdeglobals/Colors:View/BackgroundNormal' --home /home/a --home /home/b --format json
+
+        To query all config files at once mirror them into sqlite
+
+    $ kcfg --index kcfg.db --query "SELECT file, value FROM entries WHERE key = 'Key'"
 """ + ' \n') # the space is cause argparse removes empty lines
     parser.add_argument('--version', action='version', version=f"%(prog)s {__version__}")
     parser.add_argument('--version-api', action=make_final_action(_print_version_api), help='prints program version as an integer for ease of use in shell scripts')
@@ -200,61 +230,199 @@ Examples:
     parser.add_argument('--file', type=str, help='file to use for read/write operation, error if path is already specified in the path')
     parser.add_argument('--write', type=str, help='write following value VERBATIM')
     parser.add_argument('--delete', action='store_true', help='delete the key value if it exists')
-    parser.add_argument('--dry-run', dest='dry_run', action='store_true', help='prints the result instead of writing to the file, does nothing when reading')
-    parser.add_argument('-l', '--list-configs', action=make_final_action(_print_configs), help='lists all known config files then quits')
+    parser.add_argument('--dry-run', dest='dry_run', action='store_true', help='prints the changes as a diff instead of writing to the file, does nothing when reading')
+    parser.add_argument('--diff', action='store_true', help='prints the changes made to the file as a diff')
+    parser.add_argument('--kde', action='store_true', help='read the value like KDE does, decoding escapes and expanding [$e] entries (runs shell commands!)')
+    parser.add_argument('-l', '--list-configs', action='store_true', help='lists all known config files then quits')
+    parser.add_argument('--complete', metavar='PARTIAL', type=str, help='prints completion candidates for partial path, used by the shell completion scripts')
+    parser.add_argument('--completion', metavar='SHELL', choices=sorted(_COMPLETION_SCRIPTS), help='prints completion script for SHELL (%(choices)s) then quits')
+    parser.add_argument('--index', metavar='DB', type=str, help='syncs sqlite mirror of all known config files (and --file) in DB, only changed files are read again')
+    parser.add_argument('--query', metavar='SQL', type=str, help='runs SQL on the mirror from --index and prints the rows tab separated')
+    parser.add_argument('--publish', metavar='FILE', action='append', help='parses FILE (path or alias) once and publishes snapshot of it in shared memory, reads from any process use it without parsing while it is up to date')
+    parser.add_argument('--extract', metavar='TYPE:PATH', action='append', help=f'extracts value at PATH converted to TYPE ({", ".join(EXTRACT_TYPES)}) as a column, can be used multiple times')
+    parser.add_argument('--home', metavar='DIR', action='append', help='home directory to use for --extract (as a row) and --index, can be used multiple times, defaults to current home')
+    parser.add_argument('--format', choices=['csv', 'tsv', 'json'], default='csv', help='output format of --extract (default: %(default)s)')
+    parser.add_argument('--migrate', metavar='RULES', type=str, help='applies migration rules from file RULES to all known config files (or --file), works with --dry-run and --diff')
 
     # positional
-    parser.add_argument('path', help='path to use for read/write operation')
+    parser.add_argument('path', nargs='?', help='path to use for read/write operation')
 
     return parser
 
-def _info(*args, **kwargs):
-    '''Prints only if quiet is not enabled'''
-    if not _QUIET:
-        print(*args, **kwargs)
-
 def _err(*args, **kwargs): # pragma: no cover
     '''Prints error message to stderr'''
     print('[Error]', *args, **kwargs, file=sys.stderr)
 
-def _check_args(args):
+def _check_args(args, info):
     if args.dry_run:
         # prevent dry run message when reading cause its useless and messes
         # with the output
         if args.write is not None and not args.delete:
-            _info("Dry run enabled")
+            info("Dry run enabled")
 
     if args.delete and args.write is not None:
-        _err("Argument --delete and --write cannot be used together")
-        exit(1)
+        raise KcfgError("Argument --delete and --write cannot be used together")
 
+def run(raw_args, ctx=None) -> int:
+    '''Runs kcfg with arguments same like from command line and returns the exit
+    code, errors are raised as KcfgError
 
-def main(raw_args=sys.argv[1:]):
-    '''Main function, call with arguments same like from command line, will
-    always raise SystemExit'''
-    global _QUIET
+    Does not touch any global state so it is safe to call from multiple threads,
+    pass the same ctx to share the parsed file cache between calls. Only --help,
+    --version and --version-api exit'''
+    import configparser
 
     parser = _create_parser()
     args = parser.parse_args(raw_args)
-    _QUIET = args.quiet
-
-    # prevent any accidental writing to files without too much messy code
-    if not args.dry_run:
-        # real write function
-        def write(file, data):
-            with open(file, 'w') as fp:
-                write_file(fp, data)
-    else:
-        def write(file, data):
-            buffer = StringIO()
-            write_file(buffer, data)
-            print(buffer.getvalue())
+
+    if ctx is None:
+        ctx = Context(quiet=args.quiet)
+
+    quiet = ctx.quiet or args.quiet
+
+    # stdout has only the diff so it can be used directly
+    log = sys.stderr if args.dry_run or args.diff else sys.stdout
+
+    def info(*args, **kwargs):
+        '''Prints only if quiet is not enabled'''
+        if not quiet:
+            kwargs.setdefault('file', log)
+            print(*args, **kwargs)
+
+    if args.completion:
+        print(_COMPLETION_SCRIPTS[args.completion], end='')
+        return 0
+
+    if args.complete is not None:
+        for candidate in complete_path(args.complete, args.file, ctx.files):
+            print(candidate)
+        return 0
+
+    if args.list_configs:
+        _print_configs(ctx.files)
+        return 0
+
+    if args.query is not None and args.index is None:
+        raise KcfgError("Argument --query requires --index")
+
+    if args.index is not None:
+        if args.home:
+            files = [y for x in args.home for y in _home_files(ctx.files, x).values()]
+        else:
+            files = list(ctx.files.values())
+
+        if args.file:
+            files.append(args.file)
+
+        import sqlite3
+
+        try:
+            updated, removed = sync_index(args.index, files)
+        except sqlite3.Error as e:
+            raise KcfgError(f"Indexing failed: {e}")
+
+        info(f"Indexed {updated} changed files, removed {removed} files from '{args.index}'", file=sys.stderr)
+
+        if args.query is not None:
+            try:
+                _, rows = query_index(args.index, args.query)
+            except sqlite3.Error as e:
+                raise KcfgError(f"Query failed: {e}")
+
+            for row in rows:
+                print('\t'.join('' if x is None else str(x) for x in row))
+
+        return 0
+
+    if args.publish:
+        for file in args.publish:
+            file = ctx.files.get(file.lower(), file)
+            try:
+                snapshot = publish_snapshot(file)
+            except (OSError, UnicodeDecodeError, configparser.Error) as e:
+                raise KcfgError(f"Could not publish '{file}': {e}")
+
+            info(f"Published '{file}' to '{snapshot}'", file=sys.stderr)
+
+        return 0
+
+    if args.extract:
+        if args.home:
+            rows = [(x, _home_files(ctx.files, x)) for x in args.home]
+        else:
+            rows = [(os.path.expanduser('~'), dict(ctx.files))]
+
+        # paths without alias use --file
+        if args.file:
+            for _, files in rows:
+                files[''] = args.file
+
+        try:
+            specs = [_parse_extract_spec(x) for x in args.extract]
+        except RuntimeError as e:
+            raise KcfgError(str(e))
+
+        header, table, errors = extract_table(rows, specs)
+        for label, path, message in errors:
+            _err(f"{label}: {path}: {message}")
+
+        if args.format == 'json':
+            import json
+
+            print(json.dumps([dict(zip(header, x)) for x in table], ensure_ascii=False))
+        else:
+            import csv
+
+            writer = csv.writer(sys.stdout, delimiter='\t' if args.format == 'tsv' else ',', lineterminator='\n')
+            writer.writerow(header)
+            writer.writerows([_cell_text(y) for y in x] for x in table)
+
+        return 0
+
+    if args.migrate is not None:
+        try:
+            with open(args.migrate, 'r') as fp:
+                migration = Migration.from_file(fp)
+        except (OSError, RuntimeError, configparser.Error) as e:
+            raise KcfgError(f"Invalid migration rules '{args.migrate}': {e}")
+
+        if args.file:
+            files = [args.file]
+        else:
+            files = [x for x in dict.fromkeys(ctx.files.values()) if os.path.exists(x)]
+
+        stats = {}
+        for file in files:
+            def migrate(data):
+                new = migration.apply(data, file, stats)
+                data.clear()
+                data.update(new)
+
+            # the migration copies only the sections it changes
+            _, old, new = ctx.cache.update(file, migrate, [], args.dry_run)
+
+            if args.dry_run or args.diff:
+                for line in diff_data(old, new, file, file):
+                    print(line)
+
+        for name, (hits, seconds) in stats.items():
+            info(f"Rule '{name}': {hits} hits in {seconds * 1000:.2f} ms", file=sys.stderr)
+
+        return 0
+
+    # path is optional only for the completion, index, publish, extract and
+    # migrate options
+    if args.path is None:
+        parser.error('the following arguments are required: path')
 
     # check if args are correct, not conflict etc
-    _check_args(args)
+    _check_args(args, info)
 
     # parse the path
-    path, file = _parse_path(args.path)
+    try:
+        path, file = _parse_path(args.path)
+    except RuntimeError as e:
+        raise KcfgError(str(e))
 
     if file and args.file: # pragma: no cover
         _err("File already provided in path, --file argument is ignored")
@@ -267,64 +435,73 @@ def main(raw_args=sys.argv[1:]):
 
         # lowercase cause some files are just weirdly cased
         file = file.lower()
-        if file in PREDEFINED_FILES:
-            file = PREDEFINED_FILES[file]
+        if file in ctx.files:
+            file = ctx.files[file]
         else:
             # the file is not known
-            _err(f"Config file '{file}' is not in the database, please provide a full path using --file argument")
-            exit(1)
+            raise KcfgError(f"Config file '{file}' is not in the database, please provide a full path using --file argument")
 
     if not file:
-        _err('No file specified')
-        exit(1)
+        raise KcfgError('No file specified')
 
     key = path.pop()
     section = ']['.join(path)
 
-    # the file may not exist
-    try:
-        with open(file, 'r') as _file:
-            data = read_file(_file)
-        del _file
-    except FileNotFoundError:
-        data = {}
-
     if args.delete:
-        _info(f"Deleting '{args.path}' in '{file}'")
+        info(f"Deleting '{args.path}' in '{file}'")
 
-        old_value = delete_section_key(data, section, key)
-        if old_value is None:
-            # exit as there is no need to write to file as either the section
-            # or the key do not exist
-            exit(0)
+        old_value, diff = ctx.delete(file, section, key, args.dry_run)
 
-        _info(f"Value was '{old_value}'")
+        # either the section or the key do not exist, nothing was written
+        if old_value is None:
+            return 0
 
-        write(file, data)
+        info(f"Value was '{old_value}'")
     elif args.write is not None:
-        _info(f"Setting '{args.path}' to '{args.write}' in '{file}'")
+        info(f"Setting '{args.path}' to '{args.write}' in '{file}'")
 
-        old_value = set_section_key(data, section, key, args.write)
+        old_value, diff = ctx.write(file, section, key, args.write, args.dry_run)
         if old_value is not None:
-            _info(f"Value was '{old_value}'")
-
-        write(file, data)
+            info(f"Value was '{old_value}'")
     else:
         # all logs should be in stderr to allow capturing the data even without
         # quiet flag
-        if not data:
-            _info(f"File '{file}' is empty or does not exist", file=sys.stderr)
+        value = ctx.read(file, section, key, kde=args.kde)
+        if value is not None:
+            print(value)
+        elif not ctx.cache.read(file):
+            info(f"File '{file}' is empty or does not exist", file=sys.stderr)
+        else: # pragma: no cover
+            info(f"Path '{args.path}' not found in '{file}'", file=sys.stderr)
 
-            exit(0)
+        return 0
 
-        value = read_section_key(data, section, key)
-        if value is None: # pragma: no cover
-            _info(f"Path '{args.path}' not found in '{file}'", file=sys.stderr)
-        else:
-            print(value)
+    if args.dry_run or args.diff:
+        for line in diff:
+            print(line)
+
+    return 0
+
+def main(raw_args=sys.argv[1:]):
+    '''Main function, call with arguments same like from command line, will
+    always raise SystemExit'''
+    candidates = _fast_complete(raw_args)
+    if candidates is not None:
+        for candidate in candidates:
+            print(candidate)
+        exit(0)
+
+    # only the command line parses huge files in parallel, it has no threads
+    ctx = Context(cache=FileCache(jobs=None))
+
+    try:
+        code = run(raw_args, ctx)
+    except KcfgError as e:
+        _err(e)
+        code = e.code
 
-    # to be consistant when using python, always exit with 0 aka SystemExit
-    exit(0)
+    # to be consistant when using python, always exit aka SystemExit
+    exit(code)
 
 ## API ##
 
@@ -333,6 +510,8 @@ def write_file(fp, data):
 
     I think there is no need for any processing, just using bare `configparser`
     """
+    import configparser
+
     parser = configparser.ConfigParser()
 
     # preserves case
@@ -343,24 +522,136 @@ def write_file(fp, data):
     # kwriteconfig5 does not add spaces around delimiters
     parser.write(fp, space_around_delimiters=False)
 
-# TODO deal with locking [$i]
-# TODO deal with dynamic evaluation [$e]
-# read more at https://userbase.kde.org/KDE_System_Administration/Configuration_Files#Example:_Using_[$i]
-def read_file(fp) -> dict:
-    """Reads data from KDE INI config file
+def _replace_file(file, data):
+    """Writes data to file through a temporary file in the same directory that
+    replaces it, so the file is never left empty or half written
 
-    There was no need for nay processing as configparser does not care for correctness
+    Mode and owner of the file are kept and symlinks are followed
     """
-    parser = configparser.ConfigParser()
+    import io
+    import tempfile
+
+    # serialize first so errors never touch the file
+    text = io.StringIO()
+    write_file(text, data)
+    text = text.getvalue()
+
+    file = os.path.realpath(file)
+    try:
+        st = os.stat(file)
+    except FileNotFoundError:
+        # nothing to lose
+        with open(file, 'w') as fp:
+            fp.write(text)
+        return
+
+    fd, temp = tempfile.mkstemp(prefix=f'.{os.path.basename(file)}.', suffix='.tmp', dir=os.path.dirname(file))
+    try:
+        os.fchmod(fd, st.st_mode & 0o7777)
+        if (st.st_uid, st.st_gid) != (os.getuid(), os.getgid()):
+            try:
+                os.fchown(fd, st.st_uid, st.st_gid)
+            except PermissionError: # pragma: no cover
+                pass
+
+        with open(fd, 'w') as fp:
+            fp.write(text)
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        os.replace(temp, file)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+# files larger than this many characters are parsed in parallel with jobs=None
+PARALLEL_THRESHOLD = 4 * 1024 * 1024
+
+def _parse_string(text: str) -> dict:
+    '''Parses text using configparser, duplicate sections and keys are merged
+    with the last one winning like KDE does'''
+    import configparser
+
+    parser = configparser.ConfigParser(strict=False)
 
     # preserves the case
     parser.optionxform = str
 
-    parser.read_string(fp.read())
+    parser.read_string(text)
 
     # return a dict
     return { x: dict(parser.items(x)) for x in parser.sections() }
 
+def _split_sections(text: str, chunks: int) -> List[str]:
+    '''Splits text into about equally sized chunks, only at lines starting a
+    section so each chunk can be parsed on its own'''
+    size = len(text) // chunks
+    parts = []
+    start = 0
+    while start < len(text):
+        end = text.find('\n[', start + size)
+        if end == -1:
+            parts.append(text[start:])
+            break
+
+        parts.append(text[start:end + 1])
+        start = end + 1
+
+    return parts
+
+def _merge_parsed(parts) -> dict:
+    '''Merges data parsed from consecutive chunks in order, same as
+    configparser does with duplicate sections'''
+    data = {}
+    for part in parts:
+        for section, keys in part.items():
+            if section in data:
+                data[section].update(keys)
+            else:
+                data[section] = keys
+
+    return data
+
+# TODO deal with locking [$i]
+# NOTE values are returned raw, use read_section_key_kde for escapes and [$e]
+# read more at https://userbase.kde.org/KDE_System_Administration/Configuration_Files#Example:_Using_[$i]
+def read_file(fp, jobs: Optional[int] = 1) -> dict:
+    """Reads data from KDE INI config file
+
+    There was no need for nay processing as configparser does not care for correctness
+
+    Huge files can be split at section boundaries and parsed by jobs processes,
+    with jobs=None all cores are used for files larger than PARALLEL_THRESHOLD.
+    Processes are spawned, never forked, so it is safe with threads running but
+    the main module must be importable without side effects
+    """
+    text = fp.read()
+
+    if jobs is None:
+        jobs = (os.cpu_count() or 1) if len(text) >= PARALLEL_THRESHOLD else 1
+
+    # DEFAULT section applies to all sections so the chunks are not independent
+    if jobs > 1 and '[DEFAULT]' not in text:
+        chunks = _split_sections(text, jobs)
+        if len(chunks) > 1:
+            import pickle
+            import configparser
+            import multiprocessing
+            import concurrent.futures
+
+            try:
+                with concurrent.futures.ProcessPoolExecutor(len(chunks), multiprocessing.get_context('spawn')) as pool:
+                    return _merge_parsed(pool.map(_parse_string, chunks))
+            except (OSError, pickle.PicklingError, concurrent.futures.process.BrokenProcessPool): # pragma: no cover
+                # processes are not available, just parse it here
+                pass
+            except configparser.Error:
+                # line numbers are relative to the chunk, parse it again so
+                # the error points to the right line
+                pass
+
+    return _parse_string(text)
+
 def delete_section_key(data, section, key) -> Optional[str]:
     """Deletes the key in section of data, returns original value if it exists
     otherwise None"""
@@ -395,6 +686,1287 @@ def read_section_key(data, section, key, default=None) -> Optional[str]:
     except KeyError:
         return default
 
+def diff_data(old, new, fromfile='', tofile='') -> List[str]:
+    """Returns key level diff between data old and new as lines in unified diff
+    like format, empty list if there are no differences
+
+    Each changed section is its own hunk with the section name in the hunk
+    header, the files are never serialized so it is cheap even on huge files
+    """
+    lines = []
+    for section in dict.fromkeys([*old, *new]):
+        old_keys = old.get(section, {})
+        new_keys = new.get(section, {})
+        if old_keys == new_keys:
+            continue
+
+        hunk = []
+        for key in dict.fromkeys([*old_keys, *new_keys]):
+            old_value = old_keys.get(key)
+            new_value = new_keys.get(key)
+            if old_value == new_value:
+                continue
+
+            if old_value is not None:
+                hunk.append(f'-{key}={old_value}')
+            if new_value is not None:
+                hunk.append(f'+{key}={new_value}')
+
+        if not lines:
+            lines += [f'--- {fromfile}', f'+++ {tofile}']
+
+        lines.append(f'@@ [{section}] @@')
+        lines += hunk
+
+    return lines
+
+## Core ##
+
+class KcfgError(Exception):
+    '''Error raised by run instead of exiting, code is the exit code'''
+    def __init__(self, message, code=1):
+        super().__init__(message)
+        self.code = code
+
+class _Guard:
+    '''Context manager calling acquire on enter and release on exit'''
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+
+    def __exit__(self, *args):
+        self._release()
+
+class _RWLock:
+    '''Lock that allows many readers or a single writer, waiting writers block
+    new readers so they cannot starve'''
+    def __init__(self):
+        import threading
+
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def _acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def _release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def _acquire_write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def _release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    def reading(self) -> _Guard:
+        return _Guard(self._acquire_read, self._release_read)
+
+    def writing(self) -> _Guard:
+        return _Guard(self._acquire_write, self._release_write)
+
+class FileCache:
+    """Cache of parsed files that can be shared between threads
+
+    Every file has its own reader/writer lock so any number of threads can read
+    files at once, while writers wait only for others using the same file.
+    Cached data is reparsed when stat of the file changes
+
+    Data returned by read is shared between all readers so it must not be
+    modified, writes replace it with a modified copy instead
+
+    jobs is passed to read_file, files are parsed serially by default
+    """
+    def __init__(self, jobs: Optional[int] = 1):
+        import threading
+
+        self.jobs = jobs
+
+        self._lock = threading.Lock()
+
+        # path -> [lock, (stat, data)]
+        self._entries = {}
+
+    def _entry(self, file) -> list:
+        with self._lock:
+            entry = self._entries.get(file)
+            if entry is None:
+                entry = self._entries[file] = [_RWLock(), (None, {})]
+
+            return entry
+
+    def _load(self, file, entry) -> dict:
+        '''Returns data of file, must be called with the lock of entry held'''
+        stat = _stat_key(file)
+        if stat is None:
+            return {}
+
+        cached_stat, data = entry[1]
+        if cached_stat == stat:
+            return data
+
+        with open(file, 'r') as fp:
+            data = read_file(fp, self.jobs)
+
+        # assigned at once so other readers never see stat and data mismatched
+        entry[1] = (stat, data)
+        return data
+
+    def read(self, file) -> dict:
+        '''Returns parsed data of file, empty dict if the file does not exist'''
+        file = os.path.abspath(file)
+        entry = self._entry(file)
+        with entry[0].reading():
+            return self._load(file, entry)
+
+    def update(self, file, fn, sections=None, dry_run=False) -> Tuple[object, dict, dict]:
+        """Calls fn with a copy of data of file and writes it to the file
+        afterwards unless dry_run is set or nothing changed
+
+        Only sections are copied, or all of them if sections is None, so fn
+        must not modify any other. Returns result of fn, old and new data
+        """
+        file = os.path.abspath(file)
+        entry = self._entry(file)
+        with entry[0].writing():
+            old = self._load(file, entry)
+
+            if sections is None:
+                new = { x: dict(y) for x, y in old.items() }
+            else:
+                new = dict(old)
+                for section in sections:
+                    if section in new:
+                        new[section] = dict(new[section])
+
+            result = fn(new)
+
+            if not dry_run and new != old:
+                _replace_file(file, new)
+
+                entry[1] = (_stat_key(file), new)
+
+            return result, old, new
+
+class Context:
+    """Options and state shared by operations, use it instead of module globals
+    to stay thread safe
+
+    files is a copy of PREDEFINED_FILES unless provided, cache and expander can
+    be shared between contexts. With snapshots reads use published snapshots
+    while they are up to date
+    """
+    def __init__(self, quiet=False, files=None, cache=None, expander=None, snapshots=True):
+        self.quiet = quiet
+        self.files = dict(PREDEFINED_FILES if files is None else files)
+        self.cache = FileCache() if cache is None else cache
+        self.expander = ShellExpander() if expander is None else expander
+        self.snapshots = snapshots
+
+    def read(self, file, section, key, default=None, kde=False) -> Optional[str]:
+        '''Reads key from section of file, with kde the value is decoded and
+        expanded like KDE does'''
+        if self.snapshots and not kde:
+            snapshot = Snapshot.open(file)
+            if snapshot is not None:
+                try:
+                    with snapshot:
+                        return snapshot.get(section, key, default)
+                except (ValueError, struct.error):
+                    # corrupt snapshot, the file itself is still fine
+                    pass
+
+        data = self.cache.read(file)
+        if kde:
+            return read_section_key_kde(data, section, key, default, self.expander)
+
+        return read_section_key(data, section, key, default)
+
+    def _update_key(self, file, section, fn, dry_run) -> Tuple[Optional[str], List[str]]:
+        old_value, old, new = self.cache.update(file, fn, [section], dry_run)
+        diff = diff_data({ section: old.get(section, {}) }, { section: new.get(section, {}) }, file, file)
+        return old_value, diff
+
+    def write(self, file, section, key, value, dry_run=False) -> Tuple[Optional[str], List[str]]:
+        '''Sets key in section of file to value, returns old value and diff of
+        the change'''
+        return self._update_key(file, section, lambda data: set_section_key(data, section, key, value), dry_run)
+
+    def delete(self, file, section, key, dry_run=False) -> Tuple[Optional[str], List[str]]:
+        '''Deletes key in section of file, returns old value and diff of the
+        change'''
+        return self._update_key(file, section, lambda data: delete_section_key(data, section, key), dry_run)
+
+## KDE Values ##
+
+_ESCAPES = {
+    's': ' ',
+    't': '\t',
+    'n': '\n',
+    'r': '\r',
+    '\\': '\\',
+}
+
+# NOTE '\;' and '\,' are kept as is cause they only matter when splitting lists
+_ESCAPE_PATTERN = r'(?s)\\(x[0-9a-fA-F]{2}|.)'
+
+_EXPAND_PATTERN = r'\$(?:\((?P<command>[^)]*)\)|\{(?P<braced>\w+)\}|(?P<name>\w+)|(?P<dollar>\$))'
+
+# key suffixes of entries that are marked for expansion
+_EXPAND_SUFFIXES = ['[$e]', '[$ie]', '[$ei]']
+
+def decode_value(value: str) -> str:
+    '''Decodes KDE escapes like \\s \\t \\n \\xHH in value'''
+    # most values do not have any escapes at all
+    if '\\' not in value:
+        return value
+
+    def replace(match):
+        escape = match.group(1)
+        if len(escape) == 3:
+            return chr(int(escape[1:], 16))
+
+        return _ESCAPES.get(escape, match.group(0))
+
+    import re
+    return re.sub(_ESCAPE_PATTERN, replace, value)
+
+class ShellExpander:
+    """Expands $VAR, ${VAR} and $(command) in values like KDE does for entries
+    marked with [$e]
+
+    Command output is memoized for ttl seconds so bulk reads run each command
+    only once, commands run without stdin in / and are killed after timeout
+    seconds in which case they expand to empty string
+    """
+    def __init__(self, ttl=60.0, timeout=2.0, env=None):
+        self.ttl = ttl
+        self.timeout = timeout
+
+        # None means the environment of the current process
+        self.env = env
+
+        import threading
+
+        self._cache = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def run(self, command: str) -> str:
+        '''Returns output of command with surrounding whitespace removed
+
+        Concurrent calls with the same command wait for the one already running
+        instead of running it again'''
+        import threading
+
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                cached = self._cache.get(command)
+                if cached is not None:
+                    if cached[0] > now:
+                        return cached[1]
+
+                    del self._cache[command]
+
+                pending = self._pending.get(command)
+                if pending is None:
+                    pending = self._pending[command] = threading.Event()
+                    break
+
+            # someone else is running it, use their result
+            pending.wait()
+
+        output = ''
+        try:
+            output = self._run(command)
+        finally:
+            with self._lock:
+                # drop expired entries so the cache does not grow forever
+                for key in [k for k, v in self._cache.items() if v[0] <= now]:
+                    del self._cache[key]
+
+                self._cache[command] = (now + self.ttl, output)
+                del self._pending[command]
+
+            pending.set()
+
+        return output
+
+    def _run(self, command: str) -> str:
+        '''Runs command without caching'''
+        import signal
+        import subprocess
+
+        try:
+            # own session so everything it started can be killed on timeout
+            process = subprocess.Popen(
+                ['/bin/sh', '-c', command],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                cwd='/',
+                env=self.env,
+                text=True,
+                start_new_session=True,
+            )
+        except (OSError, ValueError):
+            # ValueError is raised for commands with null bytes
+            return ''
+
+        try:
+            output, _ = process.communicate(timeout=self.timeout)
+            return output.strip()
+        except (subprocess.TimeoutExpired, ValueError):
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError: # pragma: no cover
+                pass
+
+            process.stdout.close()
+            process.wait()
+            return ''
+
+    def expand(self, value: str) -> str:
+        '''Expands all variables and commands in value'''
+        if '$' not in value:
+            return value
+
+        env = os.environ if self.env is None else self.env
+
+        def replace(match):
+            if match.group('command') is not None:
+                return self.run(match.group('command'))
+
+            if match.group('dollar') is not None:
+                return '$'
+
+            return env.get(match.group('braced') or match.group('name'), '')
+
+        import re
+        return re.sub(_EXPAND_PATTERN, replace, value)
+
+def read_section_key_kde(data, section, key, default=None, expander=None) -> Optional[str]:
+    """Reads key from section of data like KDE would, if the key (or section)
+    does not exist then default is returned
+
+    Escapes are decoded and if the entry is marked with [$e] it is expanded
+    using expander, without expander it is left as is. Only this one value is
+    decoded so it is cheap to use on large data
+    """
+    keys = data.get(section)
+    if keys is None:
+        return default
+
+    if key in keys:
+        return decode_value(keys[key])
+
+    for suffix in _EXPAND_SUFFIXES:
+        if key + suffix in keys:
+            value = decode_value(keys[key + suffix])
+            if expander is not None:
+                value = expander.expand(value)
+
+            return value
+
+    return default
+
+## Snapshots ##
+
+# magic contains the format version
+_SNAPSHOT_MAGIC = b'KCFGSNP1'
+
+# magic, source mtime_ns, size, inode, number of slots
+_SNAPSHOT_HEADER = struct.Struct('<8sqqqI')
+
+# offset of entry, 0 if the slot is empty
+_SNAPSHOT_SLOT = struct.Struct('<I')
+
+# hash, key length, value length followed by the key and value
+_SNAPSHOT_ENTRY = struct.Struct('<III')
+
+def _snapshot_dir() -> str:
+    '''Returns directory for snapshots, shared memory if available'''
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+
+    import tempfile
+    return tempfile.gettempdir() # pragma: no cover
+
+def snapshot_path(file) -> str:
+    '''Returns path of the snapshot for file'''
+    import hashlib
+
+    name = hashlib.sha1(os.path.abspath(file).encode()).hexdigest()[:16]
+    return os.path.join(_snapshot_dir(), f'kcfg-{name}.snap')
+
+def _snapshot_key(section, key) -> bytes:
+    return f'{section}\0{key}'.encode()
+
+def publish_snapshot(file, snapshot=None) -> str:
+    """Parses file and publishes immutable hash indexed snapshot of it, returns
+    the path of the snapshot
+
+    The snapshot is replaced atomically so processes that have the old one open
+    are not affected
+    """
+    stat = _stat_key(file)
+    if stat is None:
+        raise FileNotFoundError(f"No such file '{file}'")
+
+    # never readable by more users than the file itself
+    mode = os.stat(file).st_mode & 0o700
+
+    with open(file, 'r') as fp:
+        data = read_file(fp)
+
+    entries = [(_snapshot_key(section, key), value.encode()) for section, keys in data.items() for key, value in keys.items()]
+
+    # keep the table at most half full so probes stay short
+    slots = 8
+    while slots < len(entries) * 2:
+        slots *= 2
+
+    table = [0] * slots
+    body = bytearray()
+    offset = _SNAPSHOT_HEADER.size + slots * _SNAPSHOT_SLOT.size
+    for key, value in entries:
+        key_hash = zlib.crc32(key)
+        index = key_hash & (slots - 1)
+        while table[index]:
+            index = (index + 1) & (slots - 1)
+
+        table[index] = offset + len(body)
+        body += _SNAPSHOT_ENTRY.pack(key_hash, len(key), len(value))
+        body += key
+        body += value
+
+    if snapshot is None:
+        snapshot = snapshot_path(file)
+
+    import tempfile
+
+    # the directory is shared with everyone so the name must not be guessable
+    fd, temp = tempfile.mkstemp(prefix='kcfg-', suffix='.tmp', dir=os.path.dirname(snapshot))
+    try:
+        os.fchmod(fd, mode)
+        with open(fd, 'wb') as fp:
+            fp.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, *stat, slots))
+            fp.write(struct.pack(f'<{slots}I', *table))
+            fp.write(body)
+
+        os.replace(temp, snapshot)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+    return snapshot
+
+def unpublish_snapshot(file, snapshot=None, ino=None) -> bool:
+    '''Removes snapshot of file, with ino only if it was not replaced in the
+    meantime. Returns True if it was removed'''
+    if snapshot is None:
+        snapshot = snapshot_path(file)
+
+    try:
+        st = os.stat(snapshot)
+        if st.st_uid != os.getuid() or ino is not None and st.st_ino != ino:
+            return False
+
+        os.unlink(snapshot)
+    except OSError:
+        return False
+
+    return True
+
+class Snapshot:
+    """Read only memory mapped snapshot published by publish_snapshot
+
+    Lookups hash the key and probe the table, nothing is parsed and only the
+    value that is read gets allocated
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as fp:
+            self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, *stat, self._slots = _SNAPSHOT_HEADER.unpack_from(self._map, 0)
+            if magic != _SNAPSHOT_MAGIC:
+                raise ValueError(f"Invalid snapshot '{path}'")
+        except (ValueError, struct.error):
+            self._map.close()
+            raise
+
+        self.stat = stat
+
+    @classmethod
+    def open(cls, file, snapshot=None) -> Optional['Snapshot']:
+        '''Opens snapshot of file, returns None if there is none or it is
+        stale, stale snapshots of the current user are removed'''
+        if snapshot is None:
+            snapshot = snapshot_path(file)
+
+        try:
+            # snapshots are in a shared directory so only trust ones made by
+            # the current user or root
+            st = os.stat(snapshot)
+            if st.st_uid not in (0, os.getuid()):
+                return None
+
+            opened = cls(snapshot)
+        except (OSError, ValueError, struct.error):
+            return None
+
+        if opened.stat != _stat_key(file):
+            opened.close()
+            unpublish_snapshot(file, snapshot, st.st_ino)
+            return None
+
+        return opened
+
+    def get(self, section, key, default=None) -> Optional[str]:
+        '''Reads key from section, if the key (or section) does not exist then
+        default is returned'''
+        key = _snapshot_key(section, key)
+        key_hash = zlib.crc32(key)
+        mask = self._slots - 1
+        index = key_hash & mask
+
+        # bounded so a corrupt table can not loop forever
+        for _ in range(self._slots):
+            offset, = _SNAPSHOT_SLOT.unpack_from(self._map, _SNAPSHOT_HEADER.size + index * _SNAPSHOT_SLOT.size)
+            if not offset:
+                return default
+
+            entry_hash, key_length, value_length = _SNAPSHOT_ENTRY.unpack_from(self._map, offset)
+            start = offset + _SNAPSHOT_ENTRY.size
+            if entry_hash == key_hash and key_length == len(key) and self._map[start:start + key_length] == key:
+                start += key_length
+                return self._map[start:start + value_length].decode()
+
+            index = (index + 1) & mask
+
+        return default
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+## Extraction ##
+
+_TRUE = ('true', '1', 'yes', 'on')
+_FALSE = ('false', '0', 'no', 'off')
+
+def _to_bool(value: str) -> bool:
+    lower = value.strip().lower()
+    if lower in _TRUE:
+        return True
+    if lower in _FALSE:
+        return False
+
+    raise ValueError(f"invalid bool '{value}'")
+
+def _to_float(value: str) -> float:
+    '''Converts to float, nan and inf are errors as JSON can not have them'''
+    import math
+
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"invalid float '{value}'")
+
+    return number
+
+def _to_ints(value: str) -> List[int]:
+    return [int(x) for x in value.split(',') if x.strip()]
+
+def _to_color(value: str) -> List[int]:
+    '''Converts 'r,g,b', 'r,g,b,a' or '#rrggbb' to list of ints'''
+    value = value.strip()
+    if value.startswith('#') and len(value) == 7:
+        return [int(value[x:x + 2], 16) for x in (1, 3, 5)]
+
+    color = _to_ints(value)
+    if len(color) not in (3, 4) or not all(0 <= x <= 255 for x in color):
+        raise ValueError(f"invalid color '{value}'")
+
+    return color
+
+def _to_font(value: str) -> dict:
+    '''Converts Qt font string 'family,size,pixel size,style hint,weight,style,...'
+    to dict'''
+    fields = value.split(',')
+    if len(fields) < 5:
+        raise ValueError(f"invalid font '{value}'")
+
+    return {
+        'family': fields[0],
+        'size': _to_float(fields[1]),
+        'pixel_size': int(fields[2]),
+        'weight': int(fields[4]),
+        'italic': len(fields) > 5 and fields[5] != '0',
+    }
+
+EXTRACT_TYPES = {
+    'str': str,
+    'bool': _to_bool,
+    'int': int,
+    'float': _to_float,
+    'ints': _to_ints,
+    'color': _to_color,
+    'font': _to_font,
+}
+
+def _parse_extract_spec(spec: str) -> Tuple[str, str]:
+    '''Parses 'TYPE:PATH' into type and path'''
+    kind, sep, path = spec.partition(':')
+    if not sep or kind not in EXTRACT_TYPES:
+        raise RuntimeError(f"Invalid extract '{spec}', expected TYPE:PATH where TYPE is one of {', '.join(EXTRACT_TYPES)}")
+
+    # fail early on invalid paths
+    _parse_path(path)
+
+    return kind, path
+
+def _cell_text(value) -> str:
+    '''Formats extracted value as text for CSV/TSV'''
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, list):
+        return ','.join(str(x) for x in value)
+    if isinstance(value, dict):
+        import json
+        return json.dumps(value, ensure_ascii=False)
+
+    return str(value)
+
+def extract_table(rows, specs) -> Tuple[List[str], List[list], List[Tuple[str, str, str]]]:
+    """Extracts typed values into a table with a row for each of rows and a
+    column for each of specs
+
+    rows is a list of (label, files) where files maps file aliases to paths, ''
+    is used for paths without an alias. specs is a list of (type, path). Each
+    file is read once per row and values are converted column by column
+
+    Returns header, table and errors as (label, path, message), cells that
+    could not be read or converted are None, missing values are not errors
+    """
+    import configparser
+
+    parsed = []
+    for _, path in specs:
+        groups, alias = _parse_path(path)
+        parsed.append((alias.lower(), ']['.join(groups[:-1]), groups[-1]))
+
+    errors = []
+    columns = [[] for _ in specs]
+    for label, files in rows:
+        cache = {}
+        for column, (_, path), (alias, section, key) in zip(columns, specs, parsed):
+            file = files.get(alias)
+            if file is None:
+                errors.append((label, path, f"unknown file '{alias}'"))
+                column.append(None)
+                continue
+
+            if file not in cache:
+                try:
+                    with open(file, 'r') as fp:
+                        cache[file] = read_file(fp)
+                except FileNotFoundError:
+                    cache[file] = {}
+                except (OSError, UnicodeDecodeError, configparser.Error) as e:
+                    cache[file] = e
+
+            data = cache[file]
+            if isinstance(data, Exception):
+                errors.append((label, path, f"could not read '{file}': {data}"))
+                column.append(None)
+            else:
+                column.append(read_section_key(data, section, key))
+
+    # convert whole columns at once
+    labels = [x[0] for x in rows]
+    for column, (kind, path) in zip(columns, specs):
+        convert = EXTRACT_TYPES[kind]
+        for i, value in enumerate(column):
+            if value is None:
+                continue
+
+            try:
+                column[i] = convert(value)
+            except ValueError as e:
+                errors.append((labels[i], path, str(e)))
+                column[i] = None
+
+    header = ['home'] + [x[1] for x in specs]
+    table = [[label, *values] for label, *values in zip(labels, *columns)]
+    return header, table, errors
+
+## Migrations ##
+
+_MIGRATION_ACTIONS = ('rename', 'move', 'rewrite')
+
+def _group_glob_to_regex(pattern: str) -> str:
+    '''Translates group glob to regex matching group paths joined with \\0
+
+    * and ? match only within a single group, while ** matches one or more
+    whole groups'''
+    import re
+
+    segments = []
+    for segment in pattern.strip('/').split('/'):
+        if segment == '**':
+            segments.append('.+')
+        else:
+            segments.append(''.join('[^\x00]*' if x == '*' else '[^\x00]' if x == '?' else re.escape(x) for x in segment))
+
+    return '\x00'.join(segments)
+
+class _Rule:
+    '''Single migration rule, see Migration for the format'''
+    def __init__(self, name, options):
+        import re
+        import fnmatch
+
+        self.name = name
+        self.action = options.get('action')
+        if self.action not in _MIGRATION_ACTIONS:
+            raise RuntimeError(f"Rule '{name}' has invalid action '{self.action}', valid are {', '.join(_MIGRATION_ACTIONS)}")
+
+        def required(option):
+            if not options.get(option):
+                raise RuntimeError(f"Rule '{name}' is missing option '{option}'")
+
+            return options[option]
+
+        self.file = options.get('file', '*').lower()
+
+        # moving all groups would merge them into one so it must be explicit
+        if self.action == 'move':
+            self.group = _group_glob_to_regex(required('group'))
+        else:
+            self.group = _group_glob_to_regex(options.get('group', '**'))
+
+        if self.action == 'rename':
+            self.key = required('key')
+            self.to = required('to')
+        elif self.action == 'move':
+            self.to = '\x00'.join(required('to').strip('/').split('/'))
+        else:
+            self.key = re.compile(fnmatch.translate(options.get('key', '*')))
+            try:
+                self.match = re.compile(required('match'))
+            except re.error as e:
+                raise RuntimeError(f"Rule '{name}' has invalid regex: {e}")
+            self.replace = options.get('replace', '')
+
+    def regex(self, index: int) -> str:
+        '''Returns regex for the combined matcher, move rules match subgroups
+        too and capture the moved prefix'''
+        if self.action == 'move':
+            return f'(?P<p{index}>{self.group})(?:\x00.*)?'
+
+        return self.group
+
+    def apply(self, path: str, keys: dict, match, index: int) -> Tuple[str, int]:
+        '''Applies rule to keys in place, returns new group path and number of
+        hits'''
+        if self.action == 'move':
+            # subgroups are taken from the original path like the match
+            return self.to + match.string[match.end(f'p{index}'):], 1
+
+        if self.action == 'rename':
+            if self.key not in keys:
+                return path, 0
+
+            keys[self.to] = keys.pop(self.key)
+            return path, 1
+
+        hits = 0
+        for key, value in keys.items():
+            if self.key.match(key):
+                new_value = self.match.sub(self.replace, value)
+                if new_value != value:
+                    keys[key] = new_value
+                    hits += 1
+
+        return path, hits
+
+class Migration:
+    """Migration rules compiled into a single matcher so every file is
+    migrated in one pass
+
+    Rules are read from INI file where each section is a rule, rules are
+    applied in order and always match the original group names
+
+        # rename key in every containment
+        [rename wallpaper key]
+        action=rename
+        group=Containments/*
+        key=wallpaperplugin
+        to=WallpaperPlugin
+
+        # move group with all its subgroups
+        [move group]
+        action=move
+        group=Old Group
+        to=New Group/Old Group
+
+        # regex rewrite of values, key is a glob
+        [rewrite theme]
+        action=rewrite
+        file=kdeglobals
+        group=**
+        key=*Theme
+        match=^Breeze$
+        replace=BreezeDark
+
+    In groups * matches within a single group while ** matches one or more
+    groups, group defaults to all groups except for move where it is required.
+    file is a glob of the file name and defaults to all files
+    """
+    def __init__(self, rules):
+        import re
+
+        self.rules = rules
+
+        # each rule is an optional lookahead so a single match on a group path
+        # tells which of the rules match it
+        self._matcher = re.compile(''.join(f'(?:(?=(?P<r{i}>{x.regex(i)})$))?' for i, x in enumerate(rules)), re.DOTALL)
+
+    @classmethod
+    def from_file(cls, fp) -> 'Migration':
+        '''Reads rules from INI file'''
+        import configparser
+
+        parser = configparser.ConfigParser(interpolation=None)
+        parser.optionxform = str
+        parser.read_string(fp.read())
+
+        return cls([_Rule(x, parser[x]) for x in parser.sections()])
+
+    def apply(self, data, file='', stats=None) -> dict:
+        """Returns data of file with all rules applied, data is not modified and
+        unchanged sections are shared with it
+
+        Hit counts and time spent are accumulated in stats as
+        { rule name: [hits, seconds] }
+        """
+        import fnmatch
+
+        name = os.path.basename(file).lower()
+        active = [(i, x) for i, x in enumerate(self.rules) if fnmatch.fnmatchcase(name, x.file)]
+
+        if stats is None:
+            stats = {}
+        for _, rule in active:
+            stats.setdefault(rule.name, [0, 0.0])
+
+        new = {}
+        for section, keys in data.items():
+            path = section.replace('][', '\x00')
+            match = self._matcher.match(path)
+
+            matched = [(i, x) for i, x in active if match.group(f'r{i}') is not None]
+            if matched:
+                keys = dict(keys)
+
+            for i, rule in matched:
+                start = time.perf_counter()
+                path, hits = rule.apply(path, keys, match, i)
+
+                stat = stats[rule.name]
+                stat[0] += hits
+                stat[1] += time.perf_counter() - start
+
+            section = path.replace('\x00', '][')
+
+            # moved groups are merged into existing ones, last wins
+            if section in new:
+                new[section] = { **new[section], **keys }
+            else:
+                new[section] = keys
+
+        return new
+
+## Index ##
+
+# group_path is the path of the group like in kcfg paths, 'Group 1/Group 2', use
+# GLOB 'Group 1/*' for prefix queries as it can use the index
+_INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    file TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    ino INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS entries (
+    file TEXT NOT NULL,
+    group_path TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    mtime REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS entries_file ON entries (file);
+CREATE INDEX IF NOT EXISTS entries_key ON entries (key);
+CREATE INDEX IF NOT EXISTS entries_group_path ON entries (group_path);
+'''
+
+def sync_index(db, files) -> Tuple[int, int]:
+    """Mirrors files into sqlite database db, only files whose stat changed
+    since the last sync are read again
+
+    Files are stored with absolute paths. Files indexed earlier are kept even
+    if they are not in files, unless they do not exist anymore. Everything is done in a single transaction, returns
+    number of files that were (re)indexed and number of files removed
+    """
+    import sqlite3
+    import configparser
+
+    conn = sqlite3.connect(db)
+    try:
+        conn.executescript(_INDEX_SCHEMA)
+
+        with conn:
+            known = { x[0]: list(x[1:]) for x in conn.execute('SELECT file, mtime_ns, size, ino FROM files') }
+
+            updated = 0
+            for file in dict.fromkeys(os.path.abspath(x) for x in files):
+                stat = _stat_key(file)
+                if stat is None or known.get(file) == stat:
+                    continue
+
+                try:
+                    with open(file, 'r') as fp:
+                        data = read_file(fp)
+                except (OSError, UnicodeDecodeError, configparser.Error) as e: # pragma: no cover
+                    _err(f"Could not index '{file}': {e}")
+                    continue
+
+                mtime = stat[0] / 1e9
+                conn.execute('DELETE FROM entries WHERE file = ?', (file,))
+                conn.executemany(
+                    'INSERT INTO entries VALUES (?, ?, ?, ?, ?)',
+                    (
+                        (file, section.replace('][', '/'), key, value, mtime)
+                        for section, keys in data.items()
+                        for key, value in keys.items()
+                    )
+                )
+                conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)', (file, *stat))
+                updated += 1
+
+            # files that were not listed are kept so files of many homes can be
+            # indexed one by one, only files that are gone are removed
+            removed = [x for x in known if _stat_key(x) is None]
+            for file in removed:
+                conn.execute('DELETE FROM entries WHERE file = ?', (file,))
+                conn.execute('DELETE FROM files WHERE file = ?', (file,))
+    finally:
+        conn.close()
+
+    return updated, len(removed)
+
+def query_index(db, sql, parameters=()) -> Tuple[List[str], List[tuple]]:
+    """Runs query on database created by sync_index, returns column names and
+    the rows
+
+    The database is opened read only so the mirror cannot be modified by accident
+    """
+    import sqlite3
+    import pathlib
+
+    conn = sqlite3.connect(pathlib.Path(db).absolute().as_uri() + '?mode=ro', uri=True)
+    try:
+        cursor = conn.execute(sql, parameters)
+        columns = [x[0] for x in cursor.description or []]
+        return columns, cursor.fetchall()
+    finally:
+        conn.close()
+
+## Completion ##
+
+# bump when the index format changes to invalidate all old indexes
+_INDEX_VERSION = 2
+
+_COMPLETION_SCRIPTS = {
+    'bash': r'''_kcfg_dequote() {
+    local word="$1"
+    word="${word#[\"\']}"
+    word="${word%[\"\']}"
+    word="${word//\\ / }"
+    [[ "$word" == "~/"* ]] && word="$HOME/${word#\~/}"
+    printf '%s' "$word"
+}
+
+_kcfg() {
+    local raw="${COMP_WORDS[COMP_CWORD]}"
+    case "$raw" in -*) return ;; esac
+
+    # bash splits words at colons which group names like 'Colors:View'
+    # contain, so rejoin them
+    local cur="$raw" i=$COMP_CWORD
+    while (( i > 1 )) && [[ "${COMP_WORDS[i-1]}" == ":" || "${COMP_WORDS[i]}" == ":" ]]; do
+        i=$((i - 1))
+        cur="${COMP_WORDS[i]}$cur"
+    done
+
+    # bash only replaces the part after the last colon
+    local colon_prefix
+    colon_prefix="$(_kcfg_dequote "${cur:0:${#cur}-${#raw}}")"
+
+    local args=(--complete "$(_kcfg_dequote "$cur")")
+    for (( i = 1; i < COMP_CWORD; i++ )); do
+        case "${COMP_WORDS[i]}" in
+            --file) args+=(--file "$(_kcfg_dequote "${COMP_WORDS[i+1]}")") ;;
+            --file=*) args+=(--file "$(_kcfg_dequote "${COMP_WORDS[i]#--file=}")") ;;
+        esac
+    done
+
+    local line
+    COMPREPLY=()
+    while IFS= read -r line; do
+        COMPREPLY+=( "${line#"$colon_prefix"}" )
+    done < <(kcfg "${args[@]}" 2>/dev/null)
+
+    # let bash quote the candidates properly, both inside and outside quotes
+    compopt -o filenames
+}
+complete -o nospace -F _kcfg kcfg
+''',
+    'zsh': r'''#compdef kcfg
+_kcfg() {
+    local -a args candidates
+    args=(--complete "${(Q)PREFIX}")
+
+    local i file
+    for (( i = 2; i < CURRENT; i++ )); do
+        case "${words[i]}" in
+            --file) file="${(Q)words[i+1]}" ;;
+            --file=*) file="${(Q)${words[i]#--file=}}" ;;
+            *) continue ;;
+        esac
+        [[ "$file" == "~/"* ]] && file="$HOME/${file#\~/}"
+        args+=(--file "$file")
+    done
+
+    candidates=( "${(@f)$(kcfg "${args[@]}" 2>/dev/null)}" )
+    compadd -U -S '' -- "${candidates[@]}"
+}
+compdef _kcfg kcfg
+''',
+    'fish': r'''function __kcfg_complete
+    set -l tokens (commandline -opc)
+    set -l args --complete (commandline -ct)
+
+    set -l index (contains -i -- --file $tokens)
+    if test -n "$index"; and test (count $tokens) -gt $index
+        set -a args --file $tokens[(math $index + 1)]
+    end
+
+    kcfg $args 2>/dev/null
+end
+complete -c kcfg -f -a '(__kcfg_complete)'
+''',
+}
+
+def _cache_dir() -> str:
+    '''Returns directory where kcfg keeps its caches'''
+    base = os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'kcfg')
+
+def _stat_key(file) -> Optional[List[int]]:
+    '''Returns stat info used to detect file changes, None if the file does not
+    exist'''
+    try:
+        st = os.stat(file)
+    except OSError:
+        return None
+
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+def _scan_index(fp) -> dict:
+    '''Scans file only for group and key names, values are never parsed so it is
+    much faster than read_file on large files'''
+    index = {}
+    keys = None
+    for line in fp:
+        if line[:1] == '[':
+            keys = index.setdefault(line.rstrip()[1:-1], {})
+        elif keys is not None and '=' in line and line[:1] not in '#; \t':
+            keys[line.split('=', 1)[0].strip()] = None
+
+    return { x: list(y) for x, y in index.items() }
+
+def _index_path(file) -> str:
+    '''Returns path of the index for file, the header of the index contains the
+    full path of file so collisions are detected'''
+    path = os.fsencode(os.path.abspath(file))
+    return os.path.join(_cache_dir(), 'index', f'{zlib.crc32(path):08x}{zlib.adler32(path):08x}')
+
+def _build_index(file) -> bytes:
+    """Builds the index of file, for every group path there is a line for each
+    subgroup and key in form of 'group path\\0child', subgroups end with a slash
+
+    Lines are sorted so children of any group path can be found by bisecting
+    """
+    with open(file, 'r') as fp:
+        index = _scan_index(fp)
+
+    lines = set()
+    for section, keys in index.items():
+        groups = section.split('][')
+        for i, group in enumerate(groups):
+            lines.add(f"{'/'.join(groups[:i])}\0{group}/")
+
+        path = '/'.join(groups)
+        lines.update(f'{path}\0{x}' for x in keys)
+
+    return ''.join(x + '\n' for x in sorted(lines)).encode()
+
+def _load_index(file) -> Tuple[Optional[object], int]:
+    '''Returns index of file (bytes or mmap) and offset where its lines start,
+    the index is cached on disk and rebuilt only when stat of file changes'''
+    stat = _stat_key(file)
+    if stat is None:
+        return None, 0
+
+    header = f"kcfg-index {_INDEX_VERSION} {' '.join(str(x) for x in stat)} ".encode() + os.fsencode(os.path.abspath(file)) + b'\n'
+
+    cache = _index_path(file)
+    try:
+        with open(cache, 'rb') as fp:
+            if fp.readline() == header:
+                return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ), len(header)
+    except (OSError, ValueError):
+        pass
+
+    index = header + _build_index(file)
+
+    # write to temporary file first so concurrent completions never see a
+    # partially written index
+    try:
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        temp = f'{cache}.{os.getpid()}.tmp'
+        with open(temp, 'wb') as fp:
+            fp.write(index)
+        os.replace(temp, cache)
+    except OSError: # pragma: no cover
+        # caching is just an optimization
+        pass
+
+    return index, len(header)
+
+def _lookup_index(index, start: int, path: str, partial: str) -> List[str]:
+    '''Returns children of group path starting with partial, bisects the
+    sorted lines so only the matching part of the index is read'''
+    target = f'{path}\0{partial}'.encode()
+
+    # find first line that is not smaller than target
+    low, high = start, len(index)
+    while low < high:
+        middle = (low + high) // 2
+        line_start = index.rfind(b'\n', 0, middle) + 1
+        line_end = index.find(b'\n', line_start)
+        if index[line_start:line_end] < target:
+            low = line_end + 1
+        else:
+            high = line_start
+
+    children = []
+    while low < len(index):
+        line_end = index.find(b'\n', low)
+        line = index[low:line_end]
+        if not line.startswith(target):
+            break
+
+        children.append(line[line.index(b'\0') + 1:].decode())
+        low = line_end + 1
+
+    return children
+
+def _fast_complete(raw_args) -> Optional[List[str]]:
+    '''Handles --complete PARTIAL [--file FILE] without argparse as it runs on
+    every TAB press, returns None if there are any other arguments'''
+    options = {}
+    args = iter(raw_args)
+    for arg in args:
+        if arg not in ('--complete', '--file') or arg in options:
+            return None
+
+        options[arg] = next(args, None)
+        if options[arg] is None:
+            return None
+
+    if '--complete' not in options:
+        return None
+
+    return complete_path(options['--complete'], options.get('--file'))
+
+def complete_path(partial: str, file: Optional[str] = None, files: Optional[dict] = None) -> List[str]:
+    '''Returns sorted completion candidates for partial path
+
+    Completes file aliases first, then groups and lastly keys, file is used
+    when partial does not contain a file alias. Aliases are taken from files,
+    PREDEFINED_FILES by default'''
+    if files is None:
+        files = PREDEFINED_FILES
+
+    segments = partial.split('/')
+    alias = segments.pop(0)
+
+    if not segments:
+        return sorted(x + '/' for x in files if x.startswith(alias.lower()))
+
+    if alias:
+        file = files.get(alias.lower())
+
+    if not file:
+        return []
+
+    try:
+        index, start = _load_index(file)
+    except (OSError, UnicodeDecodeError): # pragma: no cover
+        return []
+
+    if index is None:
+        return []
+
+    *groups, last = segments
+    prefix = alias + '/' + ''.join(x + '/' for x in groups)
+
+    try:
+        return [prefix + x for x in _lookup_index(index, start, '/'.join(groups), last)]
+    finally:
+        if isinstance(index, mmap.mmap):
+            index.close()
+
 if __name__ == '__main__':
     main()
 
@@ -0,0 +1,153 @@
+# tests for the shell completion backend
+
+import os
+import sys
+import shutil
+import subprocess
+import pytest
+import kcfg
+
+TEXT = """[Libinput][1241][Mouse]
+PointerAcceleration=-0.200
+
+[Libinput][Touchpad]
+TapToClick=true
+
+[Mouse]
+cursorTheme=breeze
+"""
+
+def test_complete_alias(monkeypatch):
+    with monkeypatch.context() as m:
+        m.setitem(kcfg.PREDEFINED_FILES, '__testfile', '')
+
+        assert kcfg.complete_path('__test') == ['__testfile/']
+
+def test_complete_groups_and_keys(tmp_path, monkeypatch):
+    file = tmp_path / 'testfile'
+    file.write_text(TEXT)
+
+    with monkeypatch.context() as m:
+        m.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+        m.setitem(kcfg.PREDEFINED_FILES, '__testfile', str(file))
+
+        assert kcfg.complete_path('__testfile/') == ['__testfile/Libinput/', '__testfile/Mouse/']
+        assert kcfg.complete_path('__testfile/Libinput/T') == ['__testfile/Libinput/Touchpad/']
+        assert kcfg.complete_path('__testfile/Libinput/Touchpad/') == ['__testfile/Libinput/Touchpad/TapToClick']
+
+        # without alias the file has to be provided
+        assert kcfg.complete_path('/Mouse/c', str(file)) == ['/Mouse/cursorTheme']
+        assert kcfg.complete_path('/Mouse/c') == []
+
+def test_index_invalidation(tmp_path, monkeypatch):
+    file = tmp_path / 'testfile'
+    file.write_text(TEXT)
+
+    with monkeypatch.context() as m:
+        m.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+
+        assert kcfg.complete_path('/Mouse/', str(file)) == ['/Mouse/cursorTheme']
+
+        # the index should be cached now
+        assert any((tmp_path / 'cache' / 'kcfg' / 'index').iterdir())
+
+        file.write_text(TEXT + 'cursorSize=24\n')
+        assert kcfg.complete_path('/Mouse/', str(file)) == ['/Mouse/cursorSize', '/Mouse/cursorTheme']
+
+class CountingIndex:
+    '''Wraps index and counts the bytes that are scanned or copied'''
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+        self.read = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def find(self, sub, start, end=None):
+        end = len(self.data) if end is None else end
+        found = self.data.find(sub, start, end)
+        self.read += (end if found == -1 else found) - start
+        return found
+
+    def rfind(self, sub, start, end):
+        found = self.data.rfind(sub, start, end)
+        self.read += end - max(found, start)
+        return found
+
+    def __getitem__(self, key):
+        value = self.data[key]
+        self.read += len(value)
+        return value
+
+def test_complete_huge_file(tmp_path, monkeypatch):
+    file = tmp_path / 'testfile'
+    file.write_text(''.join(f'[Containments][{x}][Applets][{x * 7}][Configuration][General]\nplugin=applet{x}\nColor=112,111,110\nColorAmount=0.025\n\n' for x in range(50000)))
+    assert file.stat().st_size > 4 * 1024 * 1024
+
+    with monkeypatch.context() as m:
+        m.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+
+        # builds the index
+        kcfg.complete_path('/', str(file))
+
+        # count bytes of the index that are read instead of timing it, which
+        # would be flaky on loaded machines
+        lookups = []
+        lookup = kcfg._lookup_index
+        def counting_lookup(index, *args):
+            lookups.append(CountingIndex(index))
+            return lookup(lookups[-1], *args)
+
+        m.setattr(kcfg, '_lookup_index', counting_lookup)
+        candidates = kcfg.complete_path('/Containments/4999', str(file))
+
+        assert lookups[0].size > 1024 * 1024
+        assert lookups[0].read < 64 * 1024, 'completion with built index should read only a small part of it'
+
+        assert candidates == ['/Containments/4999/'] + [f'/Containments/4999{x}/' for x in range(10)]
+        assert kcfg.complete_path('/Containments/7/Applets/49/Configuration/General/C', str(file)) == [
+            '/Containments/7/Applets/49/Configuration/General/Color',
+            '/Containments/7/Applets/49/Configuration/General/ColorAmount',
+        ]
+
+def test_complete_main(tmp_path, capsys, monkeypatch):
+    file = tmp_path / 'testfile'
+    file.write_text(TEXT)
+
+    with monkeypatch.context() as m:
+        m.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+
+        # the fast path without argparse, both orders of arguments
+        for args in (['--complete', '/Mouse/', '--file', str(file)], ['--file', str(file), '--complete', '/Mouse/']):
+            try:
+                kcfg.main(args)
+            except SystemExit as e:
+                assert e.code == 0
+
+            assert capsys.readouterr().out == '/Mouse/cursorTheme\n'
+
+@pytest.mark.skipif(shutil.which('bash') is None, reason='requires bash')
+def test_bash_script(tmp_path):
+    file = tmp_path / 'testfile'
+    file.write_text('[Colors:View]\nBackgroundNormal=1\n\n[Group 1][Sub]\nKey=1\n')
+
+    script = kcfg._COMPLETION_SCRIPTS['bash'] + f"""
+kcfg() {{ '{sys.executable}' '{kcfg.__file__}' "$@"; }}
+compopt() {{ :; }}
+complete_words() {{
+    COMP_WORDS=("$@")
+    COMP_CWORD=$(( $# - 1 ))
+    _kcfg
+    printf '%s|' "${{COMPREPLY[@]}}"
+    echo
+}}
+complete_words kcfg --file '{file}' /Colors : V
+complete_words kcfg --file='{file}' "'/Colors:V"
+complete_words kcfg --file '{file}' '/Group\\ 1/'
+"""
+
+    result = subprocess.run(['bash', '-c', script], stdout=subprocess.PIPE, text=True, env={ **os.environ, 'XDG_CACHE_HOME': str(tmp_path / 'cache') })
+
+    # words split at colons only get the part after the colon
+    assert result.stdout.splitlines() == ['View/|', '/Colors:View/|', '/Group 1/Sub/|']
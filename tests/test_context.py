@@ -0,0 +1,130 @@
+# tests for the reentrant core, run, Context and FileCache
+
+import pytest
+import threading
+import kcfg
+
+TEXT = """[Group 1][Group 2]
+Key1=One
+Key2=Two
+"""
+
+def test_run_errors():
+    # no exiting, errors are exceptions with exit code
+    with pytest.raises(kcfg.KcfgError) as e:
+        kcfg.run([])
+    assert e.value.code == 2
+
+    with pytest.raises(kcfg.KcfgError) as e:
+        kcfg.run(['/Group/Key'])
+    assert e.value.code == 1
+
+    with pytest.raises(kcfg.KcfgError) as e:
+        kcfg.run(['__testfile/Group/Key'], kcfg.Context(files={}))
+    assert e.value.code == 1
+
+    # invalid paths are errors too, not tracebacks
+    with pytest.raises(kcfg.KcfgError) as e:
+        kcfg.run(['--file', 'x', 'Key'])
+    assert e.value.code == 1
+    assert 'Invalid path' in str(e.value)
+
+def test_run_list_configs(capsys):
+    ctx = kcfg.Context(files={ '__testfile': '/tmp/__testfile' })
+    assert kcfg.run(['--list-configs'], ctx) == 0
+
+    out = capsys.readouterr().out
+    assert '/tmp/__testfile' in out
+    assert kcfg.PREDEFINED_FILES['kdeglobals'] not in out
+
+def test_run_files(tmp_path, capsys):
+    file = tmp_path / 'testfile'
+    file.write_text(TEXT)
+
+    ctx = kcfg.Context(files={ '__testfile': str(file) })
+    assert kcfg.run(['__testfile/Group 1/Group 2/Key1'], ctx) == 0
+    assert capsys.readouterr().out == 'One\n'
+
+    # the context should not be affected by changes to the module
+    assert '__testfile' not in kcfg.PREDEFINED_FILES
+
+def test_context(tmp_path):
+    file = str(tmp_path / 'testfile')
+
+    ctx = kcfg.Context()
+    assert ctx.read(file, 'Group', 'Key') is None
+
+    assert ctx.write(file, 'Group', 'Key', 'Value') == (None, [f'--- {file}', f'+++ {file}', '@@ [Group] @@', '+Key=Value'])
+    assert ctx.read(file, 'Group', 'Key') == 'Value'
+
+    # dry run does not write
+    old_value, diff = ctx.write(file, 'Group', 'Key', 'Other', dry_run=True)
+    assert old_value == 'Value'
+    assert diff[2:] == ['@@ [Group] @@', '-Key=Value', '+Key=Other']
+    assert ctx.read(file, 'Group', 'Key') == 'Value'
+
+    assert ctx.delete(file, 'Group', 'Key')[0] == 'Value'
+    assert ctx.read(file, 'Group', 'Key') is None
+
+def test_cache(tmp_path):
+    file = tmp_path / 'testfile'
+    file.write_text(TEXT)
+
+    cache = kcfg.FileCache()
+    data = cache.read(str(file))
+
+    # same data is shared while the file does not change
+    assert cache.read(str(file)) is data
+
+    # writes never modify data that was already returned
+    cache.update(str(file), lambda x: kcfg.set_section_key(x, 'Group 1][Group 2', 'Key1', 'Three'), ['Group 1][Group 2'])
+    assert data['Group 1][Group 2']['Key1'] == 'One'
+    assert cache.read(str(file))['Group 1][Group 2']['Key1'] == 'Three'
+
+    # changes from outside are picked up
+    file.write_text('[Other]\nKey=Value\n')
+    assert cache.read(str(file)) == { 'Other': { 'Key': 'Value' } }
+
+def test_concurrent_writes(tmp_path):
+    file = str(tmp_path / 'testfile')
+    ctx = kcfg.Context()
+
+    def worker(n):
+        for i in range(20):
+            ctx.write(file, 'Group', f'Key{n}_{i}', str(i))
+            ctx.read(file, 'Group', f'Key{n}_{i}')
+
+    threads = [threading.Thread(target=worker, args=(x,)) for x in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # no write should be lost
+    with open(file) as fp:
+        assert len(kcfg.read_file(fp)['Group']) == 8 * 20
+
+def test_write_failure_keeps_file(tmp_path):
+    file = tmp_path / 'testfile'
+    file.write_text(TEXT)
+    ctx = kcfg.Context()
+
+    # configparser can not write this value
+    with pytest.raises(ValueError):
+        ctx.write(str(file), 'Group 1][Group 2', 'Key3', '50%')
+
+    assert file.read_text() == TEXT
+    assert [x.name for x in tmp_path.iterdir()] == ['testfile']
+
+def test_write_keeps_mode_and_links(tmp_path):
+    file = tmp_path / 'testfile'
+    file.write_text(TEXT)
+    file.chmod(0o640)
+    link = tmp_path / 'link'
+    link.symlink_to(file)
+
+    kcfg.Context().write(str(link), 'Group 1][Group 2', 'Key3', 'Three')
+
+    assert link.is_symlink()
+    assert file.stat().st_mode & 0o777 == 0o640
+    assert 'Key3=Three' in file.read_text()
@@ -70,3 +70,65 @@ def test_dry_delete(tmp_path):
     assert file.read_text() == TEXT
 
     assert file.stat().st_mtime == mtime
+
+def test_dry_diff(tmp_path, capsys):
+    file = tmp_path / 'diff'
+    file.write_text(TEXT)
+
+    try:
+        kcfg.main(['-q', '--dry-run', '--file', str(file), '/Group 1/Group 2/Group 3/Key2', '--write', 'Three'])
+    except SystemExit:
+        pass
+
+    captured = capsys.readouterr()
+
+    # only the changed key should be printed
+    assert captured.out == f"""--- {file}
++++ {file}
+@@ [Group 1][Group 2][Group 3] @@
+-Key2=Two
++Key2=Three
+"""
+
+    try:
+        kcfg.main(['-q', '--dry-run', '--file', str(file), '/Group 1/Group 2/Group 3/Key1', '--delete'])
+    except SystemExit:
+        pass
+
+    captured = capsys.readouterr()
+
+    assert captured.out.splitlines()[2:] == ['@@ [Group 1][Group 2][Group 3] @@', '-Key1=One']
+    assert file.read_text() == TEXT
+
+def test_diff_data():
+    old = { 'A': { 'Key1': '1', 'Key2': '2' }, 'B': { 'Key': 'x' } }
+    new = { 'A': { 'Key1': '1', 'Key3': '3' }, 'C': { 'Key': 'y' } }
+
+    assert kcfg.diff_data(old, old) == []
+    assert kcfg.diff_data(old, new, 'a', 'b') == [
+        '--- a',
+        '+++ b',
+        '@@ [A] @@',
+        '-Key2=2',
+        '+Key3=3',
+        '@@ [B] @@',
+        '-Key=x',
+        '@@ [C] @@',
+        '+Key=y',
+    ]
+
+def test_dry_diff_logs(tmp_path, capsys):
+    file = tmp_path / 'diff_logs'
+    file.write_text(TEXT)
+
+    try:
+        kcfg.main(['--dry-run', '--file', str(file), '/Group 1/Group 2/Group 3/Key2', '--write', 'Three'])
+    except SystemExit:
+        pass
+
+    captured = capsys.readouterr()
+
+    # without quiet the logs go to stderr so stdout has only the diff
+    assert captured.out.splitlines()[2:] == ['@@ [Group 1][Group 2][Group 3] @@', '-Key2=Two', '+Key2=Three']
+    assert 'Dry run enabled' in captured.err
+    assert "Value was 'Two'" in captured.err
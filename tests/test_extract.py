@@ -0,0 +1,77 @@
+# tests for typed extraction of values into tables
+
+import json
+import pytest
+import kcfg
+
+KDEGLOBALS = """[ColorEffects:Inactive]
+Color=112,111,110
+ColorAmount=0.025000000000000001
+Enable=false
+
+[General]
+font=Noto Sans,10,-1,5,50,0,0,0,0,0
+"""
+
+def make_home(path, text):
+    (path / '.config').mkdir(parents=True)
+    (path / '.config' / 'kdeglobals').write_text(text)
+    return str(path)
+
+def test_conversions():
+    assert kcfg.EXTRACT_TYPES['bool'](' True') is True
+    assert kcfg.EXTRACT_TYPES['bool']('off') is False
+    assert kcfg.EXTRACT_TYPES['ints']('1,2,3') == [1, 2, 3]
+    assert kcfg.EXTRACT_TYPES['color']('#ff8000') == [255, 128, 0]
+    assert kcfg.EXTRACT_TYPES['color']('1,2,3,4') == [1, 2, 3, 4]
+    assert kcfg.EXTRACT_TYPES['font']('Noto Sans,10,-1,5,50,1,0,0,0,0') == {
+        'family': 'Noto Sans',
+        'size': 10.0,
+        'pixel_size': -1,
+        'weight': 50,
+        'italic': True,
+    }
+
+    # not valid in JSON
+    for value in ('nan', 'inf', '-Infinity'):
+        with pytest.raises(ValueError):
+            kcfg.EXTRACT_TYPES['float'](value)
+
+def test_extract_table(tmp_path):
+    files = { 'kdeglobals': make_home(tmp_path / 'a', KDEGLOBALS) + '/.config/kdeglobals' }
+    bad = { 'kdeglobals': make_home(tmp_path / 'b', KDEGLOBALS.replace('112,111,110', 'red')) + '/.config/kdeglobals' }
+
+    specs = [
+        ('color', 'kdeglobals/ColorEffects:Inactive/Color'),
+        ('float', 'kdeglobals/ColorEffects:Inactive/ColorAmount'),
+        ('bool', 'kdeglobals/ColorEffects:Inactive/Enable'),
+        ('int', 'kdeglobals/General/Missing'),
+    ]
+
+    header, table, errors = kcfg.extract_table([('a', files), ('b', bad), ('c', {})], specs)
+
+    assert header == ['home'] + [x[1] for x in specs]
+    assert table == [
+        ['a', [112, 111, 110], 0.025, False, None],
+        ['b', None, 0.025, False, None],
+        ['c', None, None, None, None],
+    ]
+
+    # errors are reported per cell
+    assert [x[:2] for x in errors] == [('c', x[1]) for x in specs] + [('b', 'kdeglobals/ColorEffects:Inactive/Color')]
+
+def test_extract_main(tmp_path, capsys):
+    home = make_home(tmp_path / 'a', KDEGLOBALS)
+
+    args = ['--extract', 'font:kdeglobals/General/font', '--extract', 'ints:kdeglobals/ColorEffects:Inactive/Color', '--home', home]
+
+    assert kcfg.run(args) == 0
+    assert capsys.readouterr().out == 'home,kdeglobals/General/font,kdeglobals/ColorEffects:Inactive/Color\n' \
+        + f'{home},"{{""family"": ""Noto Sans"", ""size"": 10.0, ""pixel_size"": -1, ""weight"": 50, ""italic"": false}}","112,111,110"\n'
+
+    assert kcfg.run(args + ['--format', 'json']) == 0
+    assert json.loads(capsys.readouterr().out) == [{
+        'home': home,
+        'kdeglobals/General/font': { 'family': 'Noto Sans', 'size': 10.0, 'pixel_size': -1, 'weight': 50, 'italic': False },
+        'kdeglobals/ColorEffects:Inactive/Color': [112, 111, 110],
+    }]
@@ -0,0 +1,118 @@
+# tests for the sqlite mirror of config files
+
+import pytest
+import sqlite3
+import kcfg
+
+TEXT = """[Group 1][Group 2]
+Key1=One
+Key2=Two
+
+[Other]
+Key1=Three
+"""
+
+def test_sync_and_query(tmp_path):
+    db = str(tmp_path / 'index.db')
+    file1 = tmp_path / 'file1'
+    file2 = tmp_path / 'file2'
+    file1.write_text(TEXT)
+    file2.write_text('[Group 1][Group 2]\nKey1=Four\n')
+
+    files = [str(file1), str(file2), str(tmp_path / 'missing')]
+    assert kcfg.sync_index(db, files) == (2, 0)
+
+    columns, rows = kcfg.query_index(db, "SELECT file, value FROM entries WHERE key = 'Key1' ORDER BY value")
+    assert columns == ['file', 'value']
+    assert rows == [(str(file2), 'Four'), (str(file1), 'One'), (str(file1), 'Three')]
+
+    # prefix queries on the group path
+    _, rows = kcfg.query_index(db, "SELECT DISTINCT file FROM entries WHERE group_path GLOB 'Group 1/*' ORDER BY file")
+    assert rows == [(str(file1),), (str(file2),)]
+
+    # nothing changed so nothing is read again
+    assert kcfg.sync_index(db, files) == (0, 0)
+
+    file2.write_text('[Group 1][Group 2]\nKey1=Five\n')
+    file1.unlink()
+    assert kcfg.sync_index(db, files) == (1, 1)
+
+    _, rows = kcfg.query_index(db, "SELECT file, value FROM entries")
+    assert rows == [(str(file2), 'Five')]
+
+def test_sync_accumulates(tmp_path):
+    db = str(tmp_path / 'index.db')
+    file1 = tmp_path / 'file1'
+    file2 = tmp_path / 'file2'
+    file1.write_text(TEXT)
+    file2.write_text(TEXT)
+
+    assert kcfg.sync_index(db, [str(file1)]) == (1, 0)
+
+    # files that are not listed are kept
+    assert kcfg.sync_index(db, [str(file2)]) == (1, 0)
+    _, rows = kcfg.query_index(db, "SELECT DISTINCT file FROM entries ORDER BY file")
+    assert rows == [(str(file1),), (str(file2),)]
+
+    # unless they do not exist anymore
+    file1.unlink()
+    assert kcfg.sync_index(db, [str(file2)]) == (0, 1)
+    _, rows = kcfg.query_index(db, "SELECT DISTINCT file FROM entries")
+    assert rows == [(str(file2),)]
+
+def test_sync_relative(tmp_path, monkeypatch):
+    db = str(tmp_path / 'index.db')
+    (tmp_path / 'dir').mkdir()
+    file = tmp_path / 'dir' / 'file'
+    file.write_text(TEXT)
+
+    monkeypatch.chdir(tmp_path / 'dir')
+    assert kcfg.sync_index(db, ['file', './file', str(file)]) == (1, 0)
+
+    # paths are absolute so they do not depend on the current directory
+    monkeypatch.chdir(tmp_path)
+    assert kcfg.sync_index(db, []) == (0, 0)
+    _, rows = kcfg.query_index(db, "SELECT file FROM files")
+    assert rows == [(str(file),)]
+
+def test_index_error(tmp_path):
+    with pytest.raises(kcfg.KcfgError) as e:
+        kcfg.run(['-q', '--index', str(tmp_path / 'missing' / 'index.db')])
+
+    assert e.value.code == 1
+
+def test_index_homes(tmp_path, capsys, monkeypatch):
+    for home in ('a', 'b'):
+        (tmp_path / home / '.config').mkdir(parents=True)
+    (tmp_path / 'a' / '.config' / 'kdeglobals').write_text('[General]\nColorScheme=BreezeDark\n')
+    (tmp_path / 'b' / '.config' / 'kdeglobals').write_text('[General]\nColorScheme=Breeze\n')
+
+    with monkeypatch.context() as m:
+        m.setattr(kcfg, 'PREDEFINED_FILES', { 'kdeglobals': '/nonexistent/.config/kdeglobals' })
+
+        assert kcfg.run(['-q', '--index', str(tmp_path / 'index.db'), '--home', str(tmp_path / 'a')]) == 0
+        assert kcfg.run(['-q', '--index', str(tmp_path / 'index.db'), '--home', str(tmp_path / 'b'), '--query', "SELECT file FROM entries WHERE value = 'BreezeDark'"]) == 0
+
+    assert capsys.readouterr().out == f"{tmp_path / 'a' / '.config' / 'kdeglobals'}\n"
+
+def test_query_read_only(tmp_path):
+    db = str(tmp_path / 'index.db')
+    kcfg.sync_index(db, [])
+
+    with pytest.raises(sqlite3.OperationalError):
+        kcfg.query_index(db, "DELETE FROM entries")
+
+def test_query_main(tmp_path, capsys, monkeypatch):
+    file = tmp_path / 'testfile'
+    file.write_text(TEXT)
+
+    with monkeypatch.context() as m:
+        m.setattr(kcfg, 'PREDEFINED_FILES', {})
+
+        with pytest.raises(SystemExit) as e:
+            kcfg.main(['--index', str(tmp_path / 'index.db'), '--file', str(file), '--query', "SELECT group_path, key, value FROM entries WHERE value = 'Two'"])
+
+    captured = capsys.readouterr()
+
+    assert e.value.code == 0
+    assert captured.out == 'Group 1/Group 2\tKey2\tTwo\n'
@@ -0,0 +1,133 @@
+# tests for KDE value semantics, escapes and [$e] expansion
+
+import os
+import pytest
+import threading
+import time
+import kcfg
+
+DATA = {
+    'Group': {
+        'Escaped': r'one\stwo\tthree\nfour\\five\x41\;',
+        'Plain': 'value',
+        'Path[$e]': r'$HOME/${NAME}\s$$',
+        'Command[$e]': '$(echo hello)-$(echo hello)',
+    }
+}
+
+def test_decode_value():
+    assert kcfg.decode_value('plain') == 'plain'
+    assert kcfg.decode_value(r'one\stwo\tthree\nfour\\five\x41\;') == 'one two\tthree\nfour\\fiveA\\;'
+
+def test_read_kde():
+    assert kcfg.read_section_key_kde(DATA, 'Group', 'Plain') == 'value'
+    assert kcfg.read_section_key_kde(DATA, 'Group', 'Escaped') == 'one two\tthree\nfour\\fiveA\\;'
+    assert kcfg.read_section_key_kde(DATA, 'Group', 'Missing', 1) == 1
+    assert kcfg.read_section_key_kde(DATA, 'Missing', 'Plain') is None
+
+    # without expander the value is only decoded
+    assert kcfg.read_section_key_kde(DATA, 'Group', 'Path') == '$HOME/${NAME} $$'
+
+def test_expand():
+    expander = kcfg.ShellExpander(env={ 'HOME': '/home/user', 'NAME': 'name' })
+
+    assert kcfg.read_section_key_kde(DATA, 'Group', 'Path', expander=expander) == '/home/user/name $'
+    assert kcfg.read_section_key_kde(DATA, 'Group', 'Command', expander=expander) == 'hello-hello'
+
+def test_expand_cache(monkeypatch):
+    calls = []
+    def run(self, command):
+        calls.append(command)
+        return 'output'
+
+    expander = kcfg.ShellExpander(ttl=60)
+    with monkeypatch.context() as m:
+        m.setattr(kcfg.ShellExpander, '_run', run)
+
+        for _ in range(10):
+            assert expander.expand('$(command)') == 'output'
+
+        assert len(calls) == 1
+
+        # expired entries are run again
+        expander.ttl = -1
+        expander.expand('$(other)')
+        expander.expand('$(other)')
+
+        assert len(calls) == 3
+
+def test_expand_cache_expired(monkeypatch):
+    def run(self, command):
+        return 'output'
+
+    expander = kcfg.ShellExpander(ttl=-1)
+    with monkeypatch.context() as m:
+        m.setattr(kcfg.ShellExpander, '_run', run)
+
+        for i in range(100):
+            expander.run(f'command {i}')
+
+        # expired entries are dropped instead of piling up
+        assert len(expander._cache) == 1
+
+def test_expand_cache_concurrent(monkeypatch):
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+    def run(self, command):
+        calls.append(command)
+        started.set()
+        release.wait(5)
+        return 'output'
+
+    expander = kcfg.ShellExpander(ttl=60)
+    results = []
+    with monkeypatch.context() as m:
+        m.setattr(kcfg.ShellExpander, '_run', run)
+
+        threads = [threading.Thread(target=lambda: results.append(expander.run('command'))) for _ in range(8)]
+        threads[0].start()
+        started.wait(5)
+        for t in threads[1:]:
+            t.start()
+
+        # give the others time to miss the cache while the command runs
+        time.sleep(0.1)
+        release.set()
+        for t in threads:
+            t.join()
+
+    # only one of the threads ran the command
+    assert len(calls) == 1
+    assert results == ['output'] * 8
+
+def test_expand_timeout():
+    expander = kcfg.ShellExpander(timeout=0.1)
+
+    assert expander.expand('[$(sleep 5)]') == '[]'
+
+@pytest.mark.skipif(not os.path.isdir('/proc'), reason='needs /proc')
+def test_expand_timeout_kills_all(tmp_path):
+    pid = tmp_path / 'pid'
+    expander = kcfg.ShellExpander(timeout=0.2)
+
+    assert expander.run(f'sleep 5 & echo $! > {pid}; wait') == ''
+
+    def running():
+        try:
+            with open(f'/proc/{int(pid.read_text())}/stat') as fp:
+                # killed orphans may stay zombies if init does not reap them
+                return fp.read().rpartition(')')[2].split()[0] != 'Z'
+        except FileNotFoundError:
+            return False
+
+    # the whole process group is killed, not just the shell
+    for _ in range(50):
+        if not running():
+            break
+        time.sleep(0.01)
+    else:
+        assert False, 'sleep is still running'
+
+def test_expand_null_byte():
+    assert kcfg.ShellExpander().expand('[$(echo a\0b)]') == '[]'
@@ -0,0 +1,107 @@
+# tests for the migration rules
+
+import io
+import pytest
+import kcfg
+
+RULES = r"""
+[rename]
+action=rename
+group=Containments/*
+key=Old
+to=New
+
+[move]
+action=move
+group=A
+to=B/A
+
+[rewrite]
+action=rewrite
+group=**
+key=Color*
+match=^(\d+),(\d+),(\d+)$
+replace=\3,\2,\1
+"""
+
+DATA = {
+    'Containments][1': { 'Old': 'x', 'Other': 'y' },
+    'Containments][1][Applets': { 'Old': 'x' },
+    'Containments][2': { 'Old': 'z', 'Color': '1,2,3' },
+    'A': { 'Key': 'a' },
+    'A][Sub': { 'ColorAmount': '4,5,6' },
+    'Unrelated': { 'Key': 'u' },
+}
+
+def load(text):
+    return kcfg.Migration.from_file(io.StringIO(text))
+
+def test_apply():
+    stats = {}
+    new = load(RULES).apply(DATA, 'kdeglobals', stats)
+
+    assert new == {
+        'Containments][1': { 'Other': 'y', 'New': 'x' },
+        'Containments][1][Applets': { 'Old': 'x' },
+        'Containments][2': { 'New': 'z', 'Color': '3,2,1' },
+        'B][A': { 'Key': 'a' },
+        'B][A][Sub': { 'ColorAmount': '6,5,4' },
+        'Unrelated': { 'Key': 'u' },
+    }
+
+    assert { x: y[0] for x, y in stats.items() } == { 'rename': 2, 'move': 2, 'rewrite': 2 }
+
+    # data is not modified
+    assert DATA['Containments][1'] == { 'Old': 'x', 'Other': 'y' }
+
+def test_file_filter():
+    migration = load("""
+[rename]
+action=rename
+file=kwinrc
+key=Old
+to=New
+""")
+
+    assert migration.apply({ 'G': { 'Old': '1' } }, '/home/user/.config/kwinrc') == { 'G': { 'New': '1' } }
+
+    # sections without matching rules are shared
+    data = { 'G': { 'Old': '1' } }
+    assert migration.apply(data, '/home/user/.config/kdeglobals')['G'] is data['G']
+
+def test_invalid_rules():
+    with pytest.raises(RuntimeError):
+        load('[rule]\naction=explode\n')
+
+    with pytest.raises(RuntimeError):
+        load('[rule]\naction=rename\nkey=Old\n')
+
+    with pytest.raises(RuntimeError):
+        load('[rule]\naction=rewrite\nmatch=(\n')
+
+    # move without group would merge all groups
+    with pytest.raises(RuntimeError):
+        load('[rule]\naction=move\nto=X\n')
+
+def test_migrate_main(tmp_path, capsys):
+    rules = tmp_path / 'rules.ini'
+    rules.write_text(RULES)
+
+    file = tmp_path / 'testfile'
+    text = '[A]\nKey=a\n\n[Containments][2]\nOld=z\n'
+    file.write_text(text)
+
+    assert kcfg.run(['-q', '--migrate', str(rules), '--file', str(file), '--dry-run']) == 0
+    assert file.read_text() == text
+    assert capsys.readouterr().out.splitlines()[2:] == [
+        '@@ [A] @@',
+        '-Key=a',
+        '@@ [Containments][2] @@',
+        '-Old=z',
+        '+New=z',
+        '@@ [B][A] @@',
+        '+Key=a',
+    ]
+
+    assert kcfg.run(['-q', '--migrate', str(rules), '--file', str(file)]) == 0
+    assert file.read_text() == '[B][A]\nKey=a\n\n[Containments][2]\nNew=z\n\n'
@@ -0,0 +1,86 @@
+# tests for parsing huge files in parallel
+
+import configparser
+import io
+import pytest
+import kcfg
+
+TEXT = """[Group 1]
+Key1=One
+Key2=Two
+
+[Group 2][Sub]
+Key=Value
+
+[Group 1]
+Key2=Three
+Key3=Four
+
+[Group 3]
+Key=Value
+"""
+
+def test_split_sections():
+    chunks = kcfg._split_sections(TEXT, 3)
+
+    assert len(chunks) > 1
+    assert ''.join(chunks) == TEXT
+    assert all(x.startswith('[') for x in chunks)
+
+def test_duplicate_sections():
+    # duplicate sections are merged, last wins
+    assert kcfg.read_file(io.StringIO(TEXT), 1) == {
+        'Group 1': { 'Key1': 'One', 'Key2': 'Three', 'Key3': 'Four' },
+        'Group 2][Sub': { 'Key': 'Value' },
+        'Group 3': { 'Key': 'Value' },
+    }
+
+def test_parallel_same_as_serial():
+    text = ''.join(f'[Group {x % 7}][{x}]\nKey=Value {x}\n\n[Group {x % 3}]\nKey{x}={x}\nKey=Last {x}\n\n' for x in range(200))
+
+    serial = kcfg.read_file(io.StringIO(text), 1)
+    parallel = kcfg.read_file(io.StringIO(text), 4)
+
+    assert parallel == serial
+    assert list(parallel) == list(serial)
+    assert [list(x) for x in parallel.values()] == [list(x) for x in serial.values()]
+
+def test_serial_by_default(monkeypatch, tmp_path):
+    def split(*args):
+        raise AssertionError('parsed in parallel')
+
+    monkeypatch.setattr(kcfg, 'PARALLEL_THRESHOLD', 0)
+    monkeypatch.setattr(kcfg, '_split_sections', split)
+
+    # library code never starts processes unless asked to
+    assert kcfg.read_file(io.StringIO(TEXT))['Group 3'] == { 'Key': 'Value' }
+
+    file = tmp_path / 'testfile'
+    file.write_text(TEXT)
+    assert kcfg.FileCache().read(str(file))['Group 3'] == { 'Key': 'Value' }
+
+def test_cache_jobs(monkeypatch, tmp_path):
+    jobs = []
+    def read_file(fp, *args):
+        jobs.append(args)
+        return {}
+
+    monkeypatch.setattr(kcfg, 'read_file', read_file)
+
+    file = tmp_path / 'testfile'
+    file.write_text(TEXT)
+    kcfg.FileCache(jobs=None).read(str(file))
+
+    assert jobs == [(None,)]
+
+def test_parallel_error_line():
+    text = ''.join(f'[Group {x}]\nKey=Value\n\n' for x in range(50)) + 'invalid line\n'
+
+    with pytest.raises(configparser.Error) as serial:
+        kcfg.read_file(io.StringIO(text), 1)
+
+    with pytest.raises(configparser.Error) as parallel:
+        kcfg.read_file(io.StringIO(text), 4)
+
+    # errors point to the line in the whole file
+    assert str(parallel.value) == str(serial.value)
@@ -64,3 +64,17 @@ Key1=One
 
 """
 
+
+def test_write_diff(tmp_path, capsys):
+    file = tmp_path / 'write_diff'
+    file.write_text(TEXT)
+
+    try:
+        kcfg.main(['-q', '--diff', '--file', str(file), '/Group 1/Group 2/Group 3/Key3', '--write', 'Three'])
+    except SystemExit:
+        pass
+
+    captured = capsys.readouterr()
+
+    assert captured.out.splitlines()[2:] == ['@@ [Group 1][Group 2][Group 3] @@', '+Key3=Three']
+    assert file.read_text().endswith('Key3=Three\n\n')
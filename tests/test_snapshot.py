@@ -0,0 +1,96 @@
+# tests for the published shared memory snapshots
+
+import kcfg
+
+TEXT = """[Group 1][Group 2]
+Key1=One
+Key2=Two
+
+[Other]
+Key=Ünicode
+"""
+
+def test_snapshot(tmp_path):
+    file = tmp_path / 'testfile'
+    file.write_text(TEXT)
+    snapshot = str(tmp_path / 'testfile.snap')
+
+    assert kcfg.Snapshot.open(str(file), snapshot) is None
+    assert kcfg.publish_snapshot(str(file), snapshot) == snapshot
+
+    with kcfg.Snapshot.open(str(file), snapshot) as snap:
+        assert snap.get('Group 1][Group 2', 'Key1') == 'One'
+        assert snap.get('Group 1][Group 2', 'Key2') == 'Two'
+        assert snap.get('Other', 'Key') == 'Ünicode'
+        assert snap.get('Other', 'Missing') is None
+        assert snap.get('Missing', 'Key', 1) == 1
+
+    # changing the file makes the snapshot stale
+    file.write_text(TEXT + 'Key2=Three\n')
+    assert kcfg.Snapshot.open(str(file), snapshot) is None
+
+def test_snapshot_many_keys(tmp_path):
+    file = tmp_path / 'testfile'
+    file.write_text(''.join(f'[Group {x}]\n' + ''.join(f'Key{y}={x}.{y}\n' for y in range(20)) for x in range(50)))
+    snapshot = str(tmp_path / 'testfile.snap')
+    kcfg.publish_snapshot(str(file), snapshot)
+
+    with kcfg.Snapshot.open(str(file), snapshot) as snap:
+        for x in range(50):
+            for y in range(20):
+                assert snap.get(f'Group {x}', f'Key{y}') == f'{x}.{y}'
+
+def test_context_uses_snapshot(tmp_path, monkeypatch, capsys):
+    file = tmp_path / 'testfile'
+    file.write_text(TEXT)
+
+    with monkeypatch.context() as m:
+        m.setattr(kcfg, '_snapshot_dir', lambda: str(tmp_path))
+
+        assert kcfg.run(['-q', '--publish', str(file)]) == 0
+
+        # make sure the file is not parsed at all
+        m.setattr(kcfg.FileCache, 'read', None)
+
+        assert kcfg.run(['--file', str(file), '/Group 1/Group 2/Key2']) == 0
+        assert capsys.readouterr().out == 'Two\n'
+
+def test_snapshot_mode(tmp_path):
+    file = tmp_path / 'testfile'
+    file.write_text(TEXT)
+    file.chmod(0o600)
+    snapshot = tmp_path / 'testfile.snap'
+
+    kcfg.publish_snapshot(str(file), str(snapshot))
+
+    # private files stay private
+    assert snapshot.stat().st_mode & 0o777 == 0o600
+    # and no temporary files are left behind
+    assert sorted(x.name for x in tmp_path.iterdir()) == ['testfile', 'testfile.snap']
+
+def test_snapshot_stale_removed(tmp_path):
+    file = tmp_path / 'testfile'
+    file.write_text(TEXT)
+    snapshot = tmp_path / 'testfile.snap'
+
+    kcfg.publish_snapshot(str(file), str(snapshot))
+    file.write_text(TEXT + 'Key2=Three\n')
+
+    assert kcfg.Snapshot.open(str(file), str(snapshot)) is None
+    assert not snapshot.exists()
+
+def test_context_corrupt_snapshot(tmp_path, monkeypatch, capsys):
+    file = tmp_path / 'testfile'
+    file.write_text(TEXT)
+    snapshot = tmp_path / 'testfile.snap'
+
+    with monkeypatch.context() as m:
+        m.setattr(kcfg, 'snapshot_path', lambda x: str(snapshot))
+
+        kcfg.publish_snapshot(str(file))
+
+        # keep only the header so the stat still matches
+        snapshot.write_bytes(snapshot.read_bytes()[:kcfg._SNAPSHOT_HEADER.size + 4])
+
+        assert kcfg.run(['--file', str(file), '/Group 1/Group 2/Key2']) == 0
+        assert capsys.readouterr().out == 'Two\n'